@@ -0,0 +1,28 @@
+"""
+Kernels Numba para la acumulación del heatmap.
+Si numba no está instalado, HAS_NUMBA es False y el generador usa NumPy.
+"""
+import math
+
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+
+if HAS_NUMBA:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def accumulate_gauss(acc, x1, y1, x2, y2, cx, cy, sx, sy, scale, acc_max):
+        """
+        Suma un peso gaussiano centrado en (cx, cy) sobre acc[y1:y2, x1:x2].
+        acc es entero: el peso se escala por scale y la suma satura en acc_max.
+        """
+        for y in prange(y1, y2):
+            dy = (y - cy) / sy
+            for x in range(x1, x2):
+                dx = (x - cx) / sx
+                value = acc[y, x] + int(math.exp(-(dx * dx + dy * dy) * 0.5) * scale + 0.5)
+                acc[y, x] = min(value, acc_max)
+else:
+    accumulate_gauss = None
@@ -6,10 +6,24 @@ import os
 class Settings(BaseSettings):
     # Database - SQLite por defecto para desarrollo, PostgreSQL para producción
     database_url: str = "sqlite:///./numia_vision.db"
+    # SQLite: WAL + synchronous=NORMAL (un fsync por checkpoint, no por commit)
+    sqlite_wal: bool = True
+    # TTL (segundos) del cache de estadísticas del dashboard
+    stats_cache_ttl: float = 0.5
     
     # YOLO - Usar 'n' (nano) para mejor rendimiento en Render
     yolo_model: str = "yolov8n.pt"
     confidence_threshold: float = 0.50
+    # Exportar el modelo en CPU: "" (PyTorch), "onnx" u "openvino"
+    yolo_export_format: str = ""
+    # Cuantización INT8 (sólo OpenVINO)
+    yolo_int8: bool = False
+    
+    # Batching de inferencia entre conexiones WebSocket
+    batch_max_size: int = 8
+    batch_max_wait_ms: int = 15
+    # Intervalo mínimo entre overlays de heatmap enviados en vivo (ms)
+    heatmap_update_interval_ms: int = 500
     
     # Server
     host: str = "0.0.0.0"
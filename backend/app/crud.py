@@ -1,13 +1,59 @@
 from sqlalchemy.orm import Session as DBSession
-from sqlalchemy import func, and_, case, desc
+from sqlalchemy import Integer, func, and_, case, cast, desc, select
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError, StatementError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any
+from typing import Callable, List, Optional, Dict, Any, Tuple
+import copy
+import functools
+import inspect
+import threading
+import time
+import weakref
+from cachetools import TTLCache
 from . import models, schemas
 from .config import get_settings
+from .database import SessionLocal
 
 settings = get_settings()
 IS_SQLITE = "sqlite" in settings.database_url
 
+# Cache corto para agregados que el dashboard consulta por polling:
+# K clientes a 1 Hz comparten una sola consulta cada stats_cache_ttl segundos
+_stats_cache = TTLCache(maxsize=64, ttl=settings.stats_cache_ttl)
+_stats_cache_lock = threading.Lock()
+_stats_key_locks: Dict[tuple, threading.Lock] = {}
+
+
+def _ttl_cached(fn):
+    """Cachea el resultado por (función, argumentos sin db) durante stats_cache_ttl"""
+    signature = inspect.signature(fn)
+    
+    @functools.wraps(fn)
+    def wrapper(db: DBSession, *args, **kwargs):
+        bound = signature.bind(db, *args, **kwargs)
+        bound.apply_defaults()
+        key = (fn.__name__,) + tuple(bound.arguments.values())[1:]
+        with _stats_cache_lock:
+            if key in _stats_cache:
+                return copy.deepcopy(_stats_cache[key])
+            key_lock = _stats_key_locks.setdefault(key, threading.Lock())
+        
+        # Un solo cálculo por clave: los demás pedidos esperan y leen el cache
+        with key_lock:
+            with _stats_cache_lock:
+                if key in _stats_cache:
+                    return copy.deepcopy(_stats_cache[key])
+            value = fn(db, *args, **kwargs)
+            with _stats_cache_lock:
+                _stats_cache[key] = value
+                _stats_key_locks.pop(key, None)
+        # Copia: quien llama puede mutar el dict/lista sin tocar el cache
+        return copy.deepcopy(value)
+    
+    return wrapper
+
 
 # ============ SESSIONS ============
 
@@ -22,7 +68,6 @@ def create_session(db: DBSession, camera_id: str = "default", name: str = None)
     )
     db.add(session)
     db.commit()
-    db.refresh(session)
     return session
 
 
@@ -88,9 +133,9 @@ def update_session_notes(db: DBSession, session_id: int, notes: str) -> Optional
 
 def delete_session(db: DBSession, session_id: int) -> bool:
     """Elimina una sesión y sus eventos"""
-    # Eliminar eventos
+    # Borrado explícito de eventos en la misma transacción: las tablas creadas
+    # antes del ON DELETE CASCADE no tienen la FK (create_all no las altera)
     db.query(models.SessionEvent).filter(models.SessionEvent.session_id == session_id).delete()
-    # Eliminar sesión
     result = db.query(models.Session).filter(models.Session.id == session_id).delete()
     db.commit()
     return result > 0
@@ -114,10 +159,165 @@ def create_session_event(
     )
     db.add(event)
     db.commit()
-    db.refresh(event)
     return event
 
 
+# Buffers vivos, para escribirlos todos al apagar la app
+_buffers: "weakref.WeakSet[_RowBuffer]" = weakref.WeakSet()
+
+
+def close_buffers() -> int:
+    """Escribe y cierra todos los buffers de filas (shutdown de la app)"""
+    written = 0
+    for buffer in list(_buffers):
+        # Un buffer que falla no impide escribir los demás
+        try:
+            written += buffer.close()
+        except Exception as e:
+            print(f"[DB] Error cerrando buffer ({len(buffer.rows)} filas sin escribir): {e}")
+    return written
+
+
+def _is_row_error(e: Exception) -> bool:
+    """True si el error es de los datos de la fila y no de la conexión/base"""
+    if isinstance(e, (IntegrityError, DataError)):
+        return True
+    # Falla al convertir un parámetro (p.ej. snapshot base64 inválido)
+    return isinstance(e, StatementError) and not isinstance(e, DBAPIError)
+
+
+def flush_events(db: DBSession, buffer: List[Dict[str, Any]]) -> int:
+    """Inserta un lote de eventos en una sola transacción"""
+    if not buffer:
+        return 0
+    db.bulk_insert_mappings(models.SessionEvent, buffer)
+    db.commit()
+    return len(buffer)
+
+
+class _RowBuffer:
+    """
+    Acumula filas en memoria y las escribe en lote: un commit cada max_size
+    filas o, como mucho, max_age_ms después de la primera fila pendiente.
+    La escritura por edad la hace un hilo propio con su propia sesión, así que
+    ocurre aunque no lleguen más filas. close() escribe lo que quede.
+    
+    write(db, rows) inserta y confirma un lote (flush_events, flush_detections).
+    """
+    
+    def __init__(self, write: Callable[[DBSession, List[Dict[str, Any]]], int], max_size: int, max_age_ms: int):
+        self._write = write
+        self.max_size = max_size
+        self.max_age = max_age_ms / 1000
+        self.rows: List[Dict[str, Any]] = []
+        self._first_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        _buffers.add(self)
+    
+    def _append(self, db: DBSession, row: Dict[str, Any]) -> None:
+        """Agrega una fila y hace flush si el lote está lleno"""
+        with self._lock:
+            if not self.rows:
+                self._first_at = time.monotonic()
+            self.rows.append(row)
+            full = len(self.rows) >= self.max_size
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+                self._flusher.start()
+        if full:
+            self.flush(db)
+    
+    def is_due(self) -> bool:
+        """True si hay que escribir el lote"""
+        with self._lock:
+            if not self.rows:
+                return False
+            return len(self.rows) >= self.max_size or time.monotonic() - self._first_at >= self.max_age
+    
+    def flush(self, db: DBSession) -> int:
+        """
+        Escribe las filas pendientes. Si una fila es inválida (FK, constraint,
+        valor no serializable) se reintenta fila por fila y sólo se descartan
+        las que fallan. Ante otros errores (p.ej. la base caída) las filas
+        vuelven al buffer y se propaga el error.
+        """
+        with self._lock:
+            rows, self.rows = self.rows, []
+            self._first_at = None
+        if not rows:
+            return 0
+        try:
+            return self._write(db, rows)
+        except Exception as e:
+            db.rollback()
+            if not _is_row_error(e):
+                self._requeue(rows)
+                raise
+        
+        written = 0
+        for i, row in enumerate(rows):
+            try:
+                written += self._write(db, [row])
+            except Exception as e:
+                db.rollback()
+                if not _is_row_error(e):
+                    self._requeue(rows[i:])
+                    raise
+                print(f"[DB] Fila descartada: {e.__class__.__name__}: {e.orig if hasattr(e, 'orig') else e}")
+        return written
+    
+    def _requeue(self, rows: List[Dict[str, Any]]) -> None:
+        """Devuelve filas no escritas al frente del buffer (se reintentan tras max_age)"""
+        with self._lock:
+            self.rows[:0] = rows
+            self._first_at = time.monotonic()
+    
+    def close(self) -> int:
+        """Detiene el hilo de flush y escribe las filas pendientes"""
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        return self._flush_own_session()
+    
+    def _flush_loop(self):
+        while not self._closed.wait(self.max_age / 4):
+            if self.is_due():
+                try:
+                    self._flush_own_session()
+                except Exception as e:
+                    print(f"[DB] Error escribiendo lote: {e}")
+    
+    def _flush_own_session(self) -> int:
+        with SessionLocal() as db:
+            return self.flush(db)
+
+
+class EventBuffer(_RowBuffer):
+    """Lote de eventos de sesión"""
+    
+    def __init__(self, max_size: int = 50, max_age_ms: int = 500):
+        super().__init__(flush_events, max_size, max_age_ms)
+    
+    def add(
+        self,
+        db: DBSession,
+        session_id: int,
+        event_type: str,
+        data: Dict[str, Any],
+        snapshot_b64: str = None
+    ) -> None:
+        """Agrega un evento al lote"""
+        self._append(db, {
+            "session_id": session_id,
+            "event_type": event_type,
+            "data": data,
+            "snapshot_b64": snapshot_b64,
+            "timestamp": datetime.now()
+        })
+
+
 def get_session_events(db: DBSession, session_id: int) -> List[models.SessionEvent]:
     """Obtiene todos los eventos de una sesión"""
     return db.query(models.SessionEvent).filter(
@@ -126,19 +326,60 @@ def get_session_events(db: DBSession, session_id: int) -> List[models.SessionEve
 
 
 def create_detection(db: DBSession, detection: schemas.DetectionCreate) -> models.Detection:
-    """Guarda una nueva detección"""
+    """Guarda una nueva detección y actualiza el rollup horario"""
+    # Un solo timestamp para la fila y su hora en el rollup (no el func.now() de la base)
+    timestamp = datetime.now()
     db_detection = models.Detection(
+        timestamp=timestamp,
         person_count=detection.person_count,
         camera_id=detection.camera_id,
         confidence_avg=detection.confidence_avg,
         bounding_boxes=detection.bounding_boxes
     )
     db.add(db_detection)
+    upsert_hourly_stats(db, detection.camera_id, timestamp, [detection.person_count])
     db.commit()
-    db.refresh(db_detection)
     return db_detection
 
 
+def flush_detections(db: DBSession, buffer: List[Dict[str, Any]]) -> int:
+    """
+    Inserta un lote de detecciones y suma sus conteos al rollup horario
+    (un UPSERT por cámara y hora) en una sola transacción.
+    """
+    if not buffer:
+        return 0
+    db.bulk_insert_mappings(models.Detection, buffer)
+    
+    groups: Dict[Tuple[str, datetime], List[int]] = {}
+    for row in buffer:
+        key = (row["camera_id"], _truncate_hour(row["timestamp"]))
+        groups.setdefault(key, []).append(row["person_count"])
+    for (camera_id, hour), counts in groups.items():
+        upsert_hourly_stats(db, camera_id, hour, counts)
+    
+    db.commit()
+    return len(buffer)
+
+
+class DetectionBuffer(_RowBuffer):
+    """Lote de detecciones: saca el INSERT + commit por frame del camino caliente"""
+    
+    def __init__(self, max_size: int = 500, max_age_ms: int = 100):
+        super().__init__(flush_detections, max_size, max_age_ms)
+    
+    def add(self, db: DBSession, detection: schemas.DetectionCreate, session_id: int = None) -> None:
+        """Agrega una detección al lote"""
+        self._append(db, {
+            "session_id": session_id,
+            "person_count": detection.person_count,
+            "camera_id": detection.camera_id,
+            "confidence_avg": detection.confidence_avg,
+            "bounding_boxes": detection.bounding_boxes,
+            "timestamp": datetime.now()
+        })
+
+
 def get_detections(
     db: DBSession, 
     camera_id: str = "default",
@@ -165,6 +406,7 @@ def get_latest_detection(db: DBSession, camera_id: str = "default") -> Optional[
         .first()
 
 
+@_ttl_cached
 def get_today_stats(db: DBSession, camera_id: str = "default") -> dict:
     """Estadísticas del día actual"""
     today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
@@ -189,35 +431,61 @@ def get_today_stats(db: DBSession, camera_id: str = "default") -> dict:
     }
 
 
+def _truncate_hour(dt: datetime) -> datetime:
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def upsert_hourly_stats(db: DBSession, camera_id: str, timestamp: datetime, counts: List[int]) -> None:
+    """
+    Suma un grupo de conteos al rollup de su hora (INSERT ... ON CONFLICT DO UPDATE).
+    No hace commit: se confirma junto con la detección.
+    """
+    if not counts:
+        return
+    
+    insert_fn = sqlite_insert if IS_SQLITE else pg_insert
+    stmt = insert_fn(models.HourlyStats).values(
+        camera_id=camera_id,
+        hour=_truncate_hour(timestamp),
+        avg_count=sum(counts) / len(counts),
+        max_count=max(counts),
+        min_count=min(counts),
+        total_detections=len(counts)
+    )
+    table = models.HourlyStats
+    new = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["camera_id", "hour"],
+        set_={
+            "avg_count": (table.avg_count * table.total_detections + new.avg_count * new.total_detections)
+                         / (table.total_detections + new.total_detections),
+            "max_count": case((new.max_count > table.max_count, new.max_count), else_=table.max_count),
+            "min_count": case((new.min_count < table.min_count, new.min_count), else_=table.min_count),
+            "total_detections": table.total_detections + new.total_detections
+        }
+    )
+    db.execute(stmt)
+
+
+@_ttl_cached
 def get_hourly_data(
     db: DBSession, 
     camera_id: str = "default",
     hours: int = 24
 ) -> List[dict]:
-    """Datos agrupados por hora para gráficos"""
-    start_time = datetime.now() - timedelta(hours=hours)
+    """Datos agrupados por hora para gráficos (leídos del rollup)"""
+    start_hour = _truncate_hour(datetime.now() - timedelta(hours=hours))
     
-    if IS_SQLITE:
-        # SQLite: usar strftime
-        hour_expr = func.strftime('%Y-%m-%d %H:00:00', models.Detection.timestamp)
-    else:
-        # PostgreSQL: usar date_trunc
-        hour_expr = func.date_trunc('hour', models.Detection.timestamp)
-    
-    results = db.query(
-        hour_expr.label('hour'),
-        func.avg(models.Detection.person_count).label('avg_count'),
-        func.max(models.Detection.person_count).label('max_count')
-    ).filter(
+    results = db.query(models.HourlyStats).filter(
         and_(
-            models.Detection.camera_id == camera_id,
-            models.Detection.timestamp >= start_time
+            models.HourlyStats.camera_id == camera_id,
+            models.HourlyStats.hour >= start_hour
         )
-    ).group_by(hour_expr).order_by('hour').all()
+    ).order_by(models.HourlyStats.hour).all()
     
     return [
         {
-            "hour": r.hour if isinstance(r.hour, str) else (r.hour.isoformat() if r.hour else None),
+            "hour": r.hour.isoformat() if r.hour else None,
             "avg_count": round(r.avg_count, 1) if r.avg_count else 0,
             "max_count": r.max_count or 0
         }
@@ -226,26 +494,32 @@ def get_hourly_data(
 
 
 def get_weekly_heatmap(db: DBSession, camera_id: str = "default") -> List[dict]:
-    """Datos para heatmap semanal (día x hora)"""
-    start_time = datetime.now() - timedelta(days=7)
+    """Datos para heatmap semanal (día x hora), leídos del rollup"""
+    start_hour = _truncate_hour(datetime.now() - timedelta(days=7))
     
     if IS_SQLITE:
         # SQLite: usar strftime (%w = día de semana, %H = hora)
-        day_expr = func.cast(func.strftime('%w', models.Detection.timestamp), type_=None)
-        hour_expr = func.cast(func.strftime('%H', models.Detection.timestamp), type_=None)
+        day_expr = cast(func.strftime('%w', models.HourlyStats.hour), Integer)
+        hour_expr = cast(func.strftime('%H', models.HourlyStats.hour), Integer)
     else:
         # PostgreSQL: usar extract
-        day_expr = func.extract('dow', models.Detection.timestamp)
-        hour_expr = func.extract('hour', models.Detection.timestamp)
+        day_expr = func.extract('dow', models.HourlyStats.hour)
+        hour_expr = func.extract('hour', models.HourlyStats.hour)
+    
+    # Promedio ponderado por cantidad de detecciones de cada hora
+    weighted_avg = (
+        func.sum(models.HourlyStats.avg_count * models.HourlyStats.total_detections)
+        / func.sum(models.HourlyStats.total_detections)
+    )
     
     results = db.query(
         day_expr.label('day'),
         hour_expr.label('hour'),
-        func.avg(models.Detection.person_count).label('avg_count')
+        weighted_avg.label('avg_count')
     ).filter(
         and_(
-            models.Detection.camera_id == camera_id,
-            models.Detection.timestamp >= start_time
+            models.HourlyStats.camera_id == camera_id,
+            models.HourlyStats.hour >= start_hour
         )
     ).group_by(day_expr, hour_expr).all()
     
@@ -259,6 +533,39 @@ def get_weekly_heatmap(db: DBSession, camera_id: str = "default") -> List[dict]:
     ]
 
 
+def get_dashboard_snapshot(db: DBSession, camera_id: str = "default", hours: int = 24) -> Dict[str, Any]:
+    """
+    Todo lo que necesita el dashboard en 3 consultas en lugar de 5:
+    una fila con los agregados del día + conteo actual (subconsultas escalares),
+    el rollup horario y las alertas pendientes (de las que sale el conteo).
+    """
+    today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    det = models.Detection
+    today = and_(det.camera_id == camera_id, det.timestamp >= today_start)
+    
+    row = db.query(
+        select(det.person_count).where(det.camera_id == camera_id)
+            .order_by(det.timestamp.desc()).limit(1).scalar_subquery().label('current_count'),
+        select(func.avg(det.person_count)).where(today).scalar_subquery().label('avg_count'),
+        select(func.max(det.person_count)).where(today).scalar_subquery().label('max_count'),
+        select(func.count(det.id)).where(today).scalar_subquery().label('total')
+    ).one()
+    
+    alerts, alerts_pending = get_pending_alerts_with_count(db, camera_id)
+    
+    return {
+        "stats": {
+            "current_count": row.current_count or 0,
+            "avg_today": round(row.avg_count or 0, 1),
+            "max_today": row.max_count or 0,
+            "total_detections_today": row.total or 0,
+            "alerts_pending": alerts_pending
+        },
+        "hourly": get_hourly_data(db, camera_id, hours),
+        "alerts": alerts
+    }
+
+
 # ============ ALERTS ============
 
 def create_alert(
@@ -279,10 +586,15 @@ def create_alert(
     )
     db.add(alert)
     db.commit()
-    db.refresh(alert)
     return alert
 
 
+def get_pending_alerts_with_count(db: DBSession, camera_id: str = "default") -> Tuple[List[models.Alert], int]:
+    """Alertas no reconocidas y su cantidad, en una sola consulta"""
+    alerts = get_pending_alerts(db, camera_id)
+    return alerts, len(alerts)
+
+
 def get_pending_alerts(db: DBSession, camera_id: str = "default") -> List[models.Alert]:
     """Alertas no reconocidas"""
     return db.query(models.Alert)\
@@ -1,11 +1,21 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
+from fastapi.responses import ORJSONResponse
+from typing import List, Dict, Any, Optional, Tuple, Set, Union
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import asyncio
 import json
+import os
+import time
 
+import orjson
+
+import numpy as np
+
+from . import crud
 from .config import get_settings
-from .detector import get_detector
+from .detector import HEATMAP_FINAL_QUALITY, HEATMAP_STREAM_QUALITY, HeatmapGenerator, get_detector
 
 settings = get_settings()
 app = FastAPI(title="Numia Vision API", version="1.0.0")
@@ -21,28 +31,277 @@ app.add_middleware(
 
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: Set[WebSocket] = set()
         self.current_count: int = 0
-        self.history: List[dict] = []
         self.max_history = 100
+        # Historial como ring buffer SoA: dos arrays paralelos en vez de dicts
+        self._counts = np.zeros(self.max_history, dtype=np.int32)
+        self._times = np.zeros(self.max_history, dtype=np.float64)
+        self._head = 0
+        self._len = 0
     
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        self.active_connections.add(websocket)
         print(f"[WS] Cliente conectado. Total: {len(self.active_connections)}")
     
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+        self.active_connections.discard(websocket)
         print(f"[WS] Cliente desconectado. Total: {len(self.active_connections)}")
     
-    def add_to_history(self, count: int, timestamp: str):
-        self.history.append({"count": count, "timestamp": timestamp})
-        if len(self.history) > self.max_history:
-            self.history.pop(0)
+    def add_to_history(self, count: int, timestamp: float):
+        """Agrega un registro (timestamp en segundos epoch), pisando el más viejo"""
+        self._counts[self._head] = count
+        self._times[self._head] = timestamp
+        self._head = (self._head + 1) % self.max_history
+        self._len = min(self._len + 1, self.max_history)
+    
+    def recent_history(self, n: int) -> Dict[str, np.ndarray]:
+        """
+        Últimos n registros en orden cronológico como
+        {"counts": int32[], "timestamps": float64[]} (copias, no vistas)
+        """
+        n = min(n, self._len)
+        idx = np.arange(self._head - n, self._head) % self.max_history
+        return {"counts": self._counts[idx], "timestamps": self._times[idx]}
 
 manager = ConnectionManager()
 
+# Mensajes binarios entrantes: primer byte = tipo, resto = payload
+MSG_FRAME = 0
+
+
+async def receive_message(websocket: WebSocket) -> Dict[str, Any]:
+    """
+    Recibe un mensaje de texto (JSON) o binario. Un binario de tipo MSG_FRAME
+    llega como {"type": "frame", "frame_bytes": <JPEG>}, sin pasar por base64.
+    """
+    msg = await websocket.receive()
+    if msg["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(msg.get("code", 1000))
+    
+    data = msg.get("bytes")
+    if data is not None:
+        if data and data[0] == MSG_FRAME:
+            return {"type": "frame", "frame_bytes": memoryview(data)[1:]}
+        return {}
+    return orjson.loads(msg["text"])
+
+
+def decode_frame(detector, payload) -> Optional[np.ndarray]:
+    """Frame desde JPEG binario o, por compatibilidad, desde base64 (None si no decodifica)"""
+    if isinstance(payload, str):
+        return detector.base64_to_frame(payload)
+    return detector.bytes_to_frame(payload)
+
+
+# Opciones de orjson compartidas por todas las respuestas: arrays NumPy y
+# escalares (np.int32, np.float64...) se serializan sin pasar por Python
+JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def dumps_json(message: Dict[str, Any]) -> str:
+    return orjson.dumps(message, option=JSON_OPTIONS).decode()
+
+
+# Respuestas fijas, serializadas una sola vez
+PONG_MESSAGE = dumps_json({"type": "pong"})
+
+
+class WebSocketSender:
+    """
+    Cola de salida de una conexión con un único task que envía. Lo que se
+    acumuló mientras se enviaba sale junto: los mensajes JSON en un solo
+    {"type": "batch", "items": [...]} y, de los frames binarios, sólo el último.
+    """
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+    
+    def send_json(self, message: Dict[str, Any]):
+        # Se serializa al encolar: el batch se arma concatenando los textos
+        self.queue.put_nowait(dumps_json(message))
+    
+    def send_text(self, message: str):
+        """Encola un mensaje JSON ya serializado (p.ej. PONG_MESSAGE)"""
+        self.queue.put_nowait(message)
+    
+    def send_bytes(self, data: bytes):
+        self.queue.put_nowait(data)
+    
+    def close(self):
+        self._task.cancel()
+    
+    async def _run(self):
+        try:
+            while True:
+                items = [await self.queue.get()]
+                while True:
+                    try:
+                        items.append(self.queue.get_nowait())
+                    except asyncio.QueueEmpty:
+                        break
+                
+                messages = [item for item in items if isinstance(item, str)]
+                frames = [item for item in items if isinstance(item, bytes)]
+                
+                # Texto (no binario): los mensajes binarios son frames JPEG
+                if len(messages) == 1:
+                    await self.websocket.send_text(messages[0])
+                elif messages:
+                    await self.websocket.send_text('{"type":"batch","items":[' + ",".join(messages) + "]}")
+                if frames:
+                    await self.websocket.send_bytes(frames[-1])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[WS] Error enviando: {e}")
+
+
+class InferenceBatcher:
+    """
+    Agrupa los frames pendientes de todas las conexiones y corre una sola
+    inferencia YOLO por batch en un hilo dedicado, devolviendo cada resultado
+    a su conexión. Cada conexión tiene un único lugar en la cola: un frame
+    nuevo reemplaza al que todavía no entró a inferencia (gana el más nuevo).
+    """
+    # Una conexión cuenta para el tamaño del batch si mandó un frame hace menos de esto (s)
+    STREAM_WINDOW = 1.0
+    
+    def __init__(self, max_batch: int, max_wait_ms: int):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._pending: Dict[Any, Tuple[np.ndarray, asyncio.Future]] = {}
+        # Último submit por conexión: cuántas conexiones están mandando frames
+        self._last_submit: Dict[Any, float] = {}
+        self._wakeup: asyncio.Event = None
+        self._task: asyncio.Task = None
+        # La inferencia bloquea ~20-50 ms: fuera del event loop, en un solo hilo
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="yolo")
+    
+    async def submit(self, key: Any, frame: np.ndarray) -> Optional[Dict[str, Any]]:
+        """
+        Encola el frame de una conexión y espera su resultado (count, persons, frame JPEG).
+        Devuelve None si un frame más nuevo de la misma conexión lo reemplazó.
+        """
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        
+        self._drop_pending(key)
+        loop = asyncio.get_running_loop()
+        self._last_submit[key] = loop.time()
+        future = loop.create_future()
+        self._pending[key] = (frame, future)
+        self._wakeup.set()
+        return await future
+    
+    def discard(self, key: Any):
+        """Olvida una conexión (al cerrarse) y descarta su frame pendiente"""
+        self._last_submit.pop(key, None)
+        self._drop_pending(key)
+    
+    def _drop_pending(self, key: Any):
+        previous = self._pending.pop(key, None)
+        if previous is not None and not previous[1].done():
+            previous[1].set_result(None)
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            await self._wakeup.wait()
+            
+            # Cada conexión tiene a lo sumo un frame pendiente: no tiene sentido
+            # esperar más frames que conexiones mandando frames (con un solo
+            # cliente no se espera)
+            now = loop.time()
+            streams = sum(1 for t in self._last_submit.values() if now - t < self.STREAM_WINDOW)
+            limit = min(self.max_batch, max(1, streams))
+            deadline = now + self.max_wait
+            while len(self._pending) < limit:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            
+            batch = [self._pending.pop(key) for key in list(self._pending)[:self.max_batch]]
+            if not self._pending:
+                self._wakeup.clear()
+            if not batch:
+                continue
+            
+            frames = [item[0] for item in batch]
+            try:
+                results = await loop.run_in_executor(self._pool, self._infer, frames)
+                for (_, future), result in zip(batch, results):
+                    if future.done():
+                        continue
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+    
+    @staticmethod
+    def _infer(frames: List[np.ndarray]) -> List[Union[Dict[str, Any], Exception]]:
+        """
+        Corre en el hilo de inferencia. Si el batch falla se reintenta frame por
+        frame: el error queda sólo en el resultado del frame que lo causó.
+        """
+        detector = get_detector()
+        
+        # Codificar en el mismo hilo: los frames anotados se reutilizan en la próxima inferencia
+        def encode(result: Dict[str, Any]) -> Dict[str, Any]:
+            return {
+                "count": result["count"],
+                "persons": result["persons"],
+                "jpeg": detector.encode_frame(result["annotated_frame"])
+            }
+        
+        try:
+            return [encode(result) for result in detector.detect_people_batch(frames)]
+        except Exception:
+            if len(frames) == 1:
+                raise
+        
+        outputs: List[Union[Dict[str, Any], Exception]] = []
+        for frame in frames:
+            try:
+                outputs.append(encode(detector.detect_people(frame)))
+            except Exception as e:
+                outputs.append(e)
+        return outputs
+
+batcher = InferenceBatcher(settings.batch_max_size, settings.batch_max_wait_ms)
+
+
+@app.on_event("startup")
+async def configure_executor():
+    """
+    Executor por defecto (asyncio.to_thread) acotado a los núcleos: decode,
+    encode y render del heatmap de varios clientes corren en paralelo.
+    """
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="cpu")
+    )
+
+
+@app.on_event("shutdown")
+async def flush_db_buffers():
+    """Escribe los lotes de eventos/detecciones que queden en memoria"""
+    written = await asyncio.to_thread(crud.close_buffers)
+    if written:
+        print(f"[INFO] {written} filas pendientes escritas al apagar")
+
 
 @app.get("/")
 def root():
@@ -57,11 +316,12 @@ def health_check():
 @app.get("/api/stats/current")
 def get_current_stats():
     """Estadísticas actuales en memoria"""
-    return {
+    # ORJSONResponse serializa los arrays NumPy del historial directamente
+    return ORJSONResponse({
         "current_count": manager.current_count,
-        "history": manager.history[-50:],
+        "history": manager.recent_history(50),
         "connections": len(manager.active_connections)
-    }
+    })
 
 
 @app.websocket("/ws/detect")
@@ -69,59 +329,92 @@ async def websocket_detect(websocket: WebSocket):
     """WebSocket para detección de personas en tiempo real"""
     await manager.connect(websocket)
     detector = get_detector()
+    sender = WebSocketSender(websocket)
+    
+    # Un solo lugar para el último frame recibido: si llegan frames mientras se
+    # procesa otro, sólo se procesa el más nuevo (latencia acotada a una inferencia)
+    latest_frame: Optional[Union[str, memoryview]] = None
+    frame_ready = asyncio.Event()
+    
+    async def frame_worker():
+        nonlocal latest_frame
+        while True:
+            await frame_ready.wait()
+            frame_ready.clear()
+            payload, latest_frame = latest_frame, None
+            if payload:
+                await process_frame(payload)
+    
+    async def process_frame(payload: Union[str, memoryview]):
+        try:
+            frame = await asyncio.to_thread(decode_frame, detector, payload)
+            if frame is None:
+                print("[WS] Frame no decodificable, descartado")
+                return
+            result = await batcher.submit(websocket, frame)
+            if result is None:
+                # Reemplazado por un frame más nuevo
+                return
+            
+            # Un solo timestamp por frame, compartido por historial y respuesta
+            manager.current_count = result["count"]
+            now = time.time()
+            timestamp = datetime.fromtimestamp(now).isoformat()
+            manager.add_to_history(result["count"], now)
+            
+            response = {
+                "type": "detection",
+                "count": result["count"],
+                "persons": result["persons"],
+                "timestamp": timestamp,
+                "history": manager.recent_history(30)
+            }
+            
+            # Metadatos en JSON, el frame anotado como JPEG binario
+            sender.send_json(response)
+            sender.send_bytes(result["jpeg"])
+            
+        except Exception as e:
+            print(f"[WS] Error procesando frame: {e}")
+            import traceback
+            traceback.print_exc()
+    
+    worker = asyncio.create_task(frame_worker())
     
     try:
         while True:
             try:
-                data = await websocket.receive_text()
-                message = json.loads(data)
+                message = await receive_message(websocket)
             except json.JSONDecodeError:
                 print("[WS] Error decodificando JSON")
                 continue
+            except WebSocketDisconnect:
+                raise
             except Exception as e:
                 print(f"[WS] Error recibiendo: {e}")
                 break
             
             if message.get("type") == "frame":
-                try:
-                    frame_b64 = message.get("frame")
-                    if not frame_b64:
-                        continue
-                    
-                    frame = detector.base64_to_frame(frame_b64)
-                    result = detector.detect_people(frame)
-                    annotated_b64 = detector.frame_to_base64(result["annotated_frame"])
-                    
-                    manager.current_count = result["count"]
-                    timestamp = datetime.now().isoformat()
-                    manager.add_to_history(result["count"], timestamp)
-                    
-                    response = {
-                        "type": "detection",
-                        "count": result["count"],
-                        "persons": result["persons"],
-                        "frame": annotated_b64,
-                        "timestamp": timestamp,
-                        "history": manager.history[-30:]
-                    }
-                    
-                    await websocket.send_json(response)
-                    
-                except Exception as e:
-                    print(f"[WS] Error procesando frame: {e}")
-                    import traceback
-                    traceback.print_exc()
+                payload = message.get("frame_bytes") or message.get("frame")
+                if not payload:
                     continue
+                
+                # Reemplaza al frame que todavía no se empezó a procesar
+                latest_frame = payload
+                frame_ready.set()
             
             elif message.get("type") == "ping":
-                await websocket.send_json({"type": "pong"})
+                sender.send_text(PONG_MESSAGE)
                 
     except WebSocketDisconnect:
         print("[WS] Cliente desconectó normalmente")
-        manager.disconnect(websocket)
     except Exception as e:
         print(f"[WS] Error WebSocket: {e}")
+    finally:
         manager.disconnect(websocket)
+        batcher.discard(websocket)
+        sender.close()
+        worker.cancel()
 
 
 @app.websocket("/ws/heatmap")
@@ -130,14 +423,111 @@ async def websocket_heatmap(websocket: WebSocket):
     await manager.connect(websocket)
     detector = get_detector()
     heatmap_active = False
+    sender = WebSocketSender(websocket)
+    
+    # Mismo esquema que /ws/detect: un solo lugar para el último frame y un
+    # worker que lo procesa; gana siempre el más nuevo y no se acumulan decodes
+    latest_frame: Optional[Union[str, memoryview]] = None
+    frame_ready = asyncio.Event()
+    
+    # Estado de heatmap propio de esta conexión: el detector compartido sólo
+    # tiene el modelo. El lock serializa los accesos desde el executor.
+    heatmap: Optional[HeatmapGenerator] = None
+    heatmap_lock = asyncio.Lock()
+    
+    def render_heatmap(alpha: float, quality: int = HEATMAP_FINAL_QUALITY) -> Tuple[Optional[str], Dict[str, Any]]:
+        """Heatmap actual en base64 + stats (corre en el executor)"""
+        if heatmap is None:
+            return None, {}
+        image = heatmap.generate_heatmap(alpha)
+        return detector.frame_to_base64(image, quality), heatmap.get_stats()
+    
+    # Último overlay enviado: (total_detections, instante)
+    last_overlay = (-1, 0.0)
+    
+    def update_heatmap(persons: List[Dict[str, Any]], alpha: float) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        Suma las detecciones al heatmap y lo renderiza (corre en el executor).
+        El overlay sólo se re-codifica si cambió y pasó el intervalo mínimo;
+        si no, devuelve (None, None) y el cliente mantiene el anterior.
+        """
+        nonlocal last_overlay
+        if heatmap is None:
+            return None, None
+        heatmap.add_detections_fast(persons)
+        
+        now = time.monotonic()
+        last_detections, last_time = last_overlay
+        if (heatmap.total_detections == last_detections
+                or now - last_time < settings.heatmap_update_interval_ms / 1000):
+            return None, None
+        last_overlay = (heatmap.total_detections, now)
+        
+        # En vivo alcanza con menos calidad: se reemplaza en el próximo envío
+        return render_heatmap(alpha, HEATMAP_STREAM_QUALITY)
+    
+    async def process_frame(payload: Union[str, memoryview]):
+        try:
+            frame = await asyncio.to_thread(decode_frame, detector, payload)
+            if frame is None:
+                print("[WS Heatmap] Frame no decodificable, descartado")
+                return
+            
+            # Si no hay imagen de referencia, usar el primer frame
+            if heatmap is not None and heatmap.reference_image is None:
+                async with heatmap_lock:
+                    if heatmap.reference_image is None:
+                        heatmap.set_reference_image(frame)
+            
+            # Detectar personas
+            result = await batcher.submit(websocket, frame)
+            if result is None:
+                # Reemplazado por un frame más nuevo
+                return
+            
+            # Hora de la detección, no del fin del render
+            timestamp = datetime.now().isoformat()
+            
+            # Actualizar heatmap y obtener imagen actual y stats
+            async with heatmap_lock:
+                heatmap_b64, stats = await asyncio.to_thread(update_heatmap, result["persons"], 0.6)
+            
+            response = {
+                "type": "heatmap_update",
+                "count": result["count"],
+                "persons": result["persons"],
+                "heatmap": heatmap_b64,
+                "stats": stats,
+                "timestamp": timestamp
+            }
+            
+            sender.send_json(response)
+            sender.send_bytes(result["jpeg"])
+            
+        except Exception as e:
+            print(f"[WS Heatmap] Error procesando: {e}")
+            import traceback
+            traceback.print_exc()
+    
+    async def frame_worker():
+        nonlocal latest_frame
+        while True:
+            await frame_ready.wait()
+            frame_ready.clear()
+            payload, latest_frame = latest_frame, None
+            if payload:
+                await process_frame(payload)
+    
+    worker = asyncio.create_task(frame_worker())
     
     try:
         while True:
             try:
-                data = await websocket.receive_text()
-                message = json.loads(data)
+                message = await receive_message(websocket)
             except json.JSONDecodeError:
                 continue
+            except WebSocketDisconnect:
+                raise
             except Exception as e:
                 print(f"[WS Heatmap] Error: {e}")
                 break
@@ -148,75 +538,49 @@ async def websocket_heatmap(websocket: WebSocket):
             if msg_type == "init_heatmap":
                 try:
                     ref_image_b64 = message.get("reference_image")
-                    if ref_image_b64:
-                        ref_image = detector.base64_to_frame(ref_image_b64)
-                        detector.init_heatmap(reference_image=ref_image)
-                    else:
-                        # Sin imagen de referencia, usar dimensiones del primer frame
-                        width = message.get("width", 640)
-                        height = message.get("height", 480)
-                        detector.init_heatmap(width=width, height=height)
+                    async with heatmap_lock:
+                        if ref_image_b64:
+                            ref_image = await asyncio.to_thread(detector.base64_to_frame, ref_image_b64)
+                            h, w = ref_image.shape[:2]
+                            heatmap = HeatmapGenerator(w, h)
+                            heatmap.set_reference_image(ref_image)
+                        else:
+                            # Sin imagen de referencia, usar dimensiones del primer frame
+                            width = message.get("width", 640)
+                            height = message.get("height", 480)
+                            heatmap = HeatmapGenerator(width, height)
+                        last_overlay = (-1, 0.0)
                     
                     heatmap_active = True
-                    await websocket.send_json({
+                    sender.send_json({
                         "type": "heatmap_initialized",
                         "status": "ok"
                     })
-                    print("[WS Heatmap] Heatmap inicializado")
+                    print(f"[WS Heatmap] Heatmap inicializado: {heatmap.width}x{heatmap.height}")
                 except Exception as e:
                     print(f"[WS Heatmap] Error inicializando: {e}")
-                    await websocket.send_json({
+                    sender.send_json({
                         "type": "error",
                         "message": str(e)
                     })
             
             # Procesar frame y actualizar heatmap
             elif msg_type == "frame" and heatmap_active:
-                try:
-                    frame_b64 = message.get("frame")
-                    if not frame_b64:
-                        continue
-                    
-                    frame = detector.base64_to_frame(frame_b64)
-                    
-                    # Si no hay imagen de referencia, usar el primer frame
-                    if detector.heatmap_generator and detector.heatmap_generator.reference_image is None:
-                        detector.heatmap_generator.set_reference_image(frame)
-                    
-                    # Detectar personas y actualizar heatmap
-                    result = detector.detect_people(frame, update_heatmap=True)
-                    
-                    # Obtener heatmap actual
-                    heatmap = detector.get_heatmap(alpha=0.6)
-                    heatmap_b64 = detector.frame_to_base64(heatmap) if heatmap is not None else None
-                    
-                    # Obtener stats
-                    stats = detector.get_heatmap_stats()
-                    
-                    # Frame anotado
-                    annotated_b64 = detector.frame_to_base64(result["annotated_frame"])
-                    
-                    response = {
-                        "type": "heatmap_update",
-                        "count": result["count"],
-                        "persons": result["persons"],
-                        "frame": annotated_b64,
-                        "heatmap": heatmap_b64,
-                        "stats": stats,
-                        "timestamp": datetime.now().isoformat()
-                    }
-                    
-                    await websocket.send_json(response)
-                    
-                except Exception as e:
-                    print(f"[WS Heatmap] Error procesando: {e}")
-                    import traceback
-                    traceback.print_exc()
+                payload = message.get("frame_bytes") or message.get("frame")
+                if not payload:
+                    continue
+                
+                # Reemplaza al frame que todavía no se empezó a procesar
+                latest_frame = payload
+                frame_ready.set()
             
             # Resetear heatmap
             elif msg_type == "reset_heatmap":
-                detector.reset_heatmap()
-                await websocket.send_json({
+                if heatmap is not None:
+                    async with heatmap_lock:
+                        heatmap.reset()
+                        last_overlay = (-1, 0.0)
+                sender.send_json({
                     "type": "heatmap_reset",
                     "status": "ok"
                 })
@@ -225,11 +589,10 @@ async def websocket_heatmap(websocket: WebSocket):
             # Obtener heatmap final
             elif msg_type == "get_final_heatmap":
                 try:
-                    heatmap = detector.get_heatmap(alpha=0.7)
-                    heatmap_b64 = detector.frame_to_base64(heatmap) if heatmap is not None else None
-                    stats = detector.get_heatmap_stats()
+                    async with heatmap_lock:
+                        heatmap_b64, stats = await asyncio.to_thread(render_heatmap, 0.7)
                     
-                    await websocket.send_json({
+                    sender.send_json({
                         "type": "final_heatmap",
                         "heatmap": heatmap_b64,
                         "stats": stats
@@ -241,11 +604,10 @@ async def websocket_heatmap(websocket: WebSocket):
             elif msg_type == "stop_heatmap":
                 heatmap_active = False
                 # Obtener heatmap final antes de parar
-                heatmap = detector.get_heatmap(alpha=0.7)
-                heatmap_b64 = detector.frame_to_base64(heatmap) if heatmap is not None else None
-                stats = detector.get_heatmap_stats()
+                async with heatmap_lock:
+                    heatmap_b64, stats = await asyncio.to_thread(render_heatmap, 0.7)
                 
-                await websocket.send_json({
+                sender.send_json({
                     "type": "heatmap_stopped",
                     "heatmap": heatmap_b64,
                     "stats": stats
@@ -253,16 +615,20 @@ async def websocket_heatmap(websocket: WebSocket):
                 print("[WS Heatmap] Heatmap detenido")
             
             elif msg_type == "ping":
-                await websocket.send_json({"type": "pong"})
+                sender.send_text(PONG_MESSAGE)
                 
     except WebSocketDisconnect:
         print("[WS Heatmap] Cliente desconectó")
-        manager.disconnect(websocket)
     except Exception as e:
         print(f"[WS Heatmap] Error: {e}")
+    finally:
         manager.disconnect(websocket)
+        batcher.discard(websocket)
+        sender.close()
+        worker.cancel()
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host=settings.host, port=settings.port)
+    # loop/http en "auto": uvloop y httptools si están instalados (no hay uvloop en Windows)
+    uvicorn.run(app, host=settings.host, port=settings.port, loop="auto", http="auto", ws="websockets")
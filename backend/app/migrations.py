@@ -0,0 +1,130 @@
+"""
+Migraciones manuales (no hay Alembic: create_all no altera tablas existentes).
+
+Uso, desde backend/:
+    python -m app.migrations
+"""
+import json
+from typing import Any, Callable, Optional
+from sqlalchemy import LargeBinary, bindparam, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from . import models
+from .database import engine as default_engine
+
+
+def rebuild_hourly_stats(engine: Engine = default_engine) -> int:
+    """
+    Recrea hourly_stats con la clave única (camera_id, hour) que usa el UPSERT
+    del rollup y la rellena desde detections con un solo INSERT ... SELECT.
+    La tabla es derivada: no se pierde información.
+    """
+    det = models.Detection
+    table = models.HourlyStats.__table__
+
+    if engine.dialect.name == "sqlite":
+        # Mismo formato de texto que SQLAlchemy usa para DateTime en SQLite,
+        # así comparaciones y ON CONFLICT coinciden con las horas del rollup
+        hour_expr = func.strftime("%Y-%m-%d %H:00:00.000000", det.timestamp)
+    else:
+        hour_expr = func.date_trunc("hour", det.timestamp)
+
+    rollup = select(
+        det.camera_id,
+        hour_expr,
+        func.avg(det.person_count),
+        func.max(det.person_count),
+        func.min(det.person_count),
+        func.count(det.id)
+    ).group_by(det.camera_id, hour_expr)
+
+    with engine.begin() as conn:
+        table.drop(conn, checkfirst=True)
+        table.create(conn)
+        conn.execute(table.insert().from_select(
+            ["camera_id", "hour", "avg_count", "max_count", "min_count", "total_detections"],
+            rollup
+        ))
+        return conn.execute(select(func.count()).select_from(table)).scalar()
+
+
+def _pack_legacy_boxes(value: Any) -> Optional[bytes]:
+    """Cajas JSON viejas (planas o {"bbox": {...}}) -> formato PackedBoxes"""
+    if isinstance(value, str):
+        value = json.loads(value)
+    boxes = []
+    for box in value or []:
+        coords = box.get("bbox", box)
+        if not all(k in coords for k in ("x1", "y1", "x2", "y2")):
+            continue
+        boxes.append({**{k: coords[k] for k in ("x1", "y1", "x2", "y2")},
+                      "confidence": box.get("confidence", 0)})
+    return models.PackedBoxes().process_bind_param(boxes, None)
+
+
+def _decode_legacy_snapshot(value: Any) -> Optional[bytes]:
+    """Texto base64 (o data URL) viejo -> bytes crudos; inválido -> NULL"""
+    try:
+        return models.Base64Image().process_bind_param(value, None)
+    except ValueError as e:
+        print(f"[WARN] Snapshot descartado: {e}")
+        return None
+
+
+def _convert_column(conn: Connection, table: str, old: str, new: str, convert: Callable[[Any], Optional[bytes]]) -> int:
+    """
+    Reemplaza la columna old por una binaria new con los valores convertidos
+    (ADD COLUMN + UPDATE por fila + DROP/RENAME COLUMN).
+    """
+    tmp = f"{new}_migrated"
+    binary = LargeBinary().compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {tmp} {binary}"))
+
+    rows = conn.execute(text(f"SELECT id, {old} FROM {table} WHERE {old} IS NOT NULL")).all()
+    if rows:
+        conn.execute(
+            text(f"UPDATE {table} SET {tmp} = :value WHERE id = :id").bindparams(
+                bindparam("value", type_=LargeBinary)
+            ),
+            [{"id": row_id, "value": convert(value)} for row_id, value in rows]
+        )
+
+    conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {old}"))
+    conn.execute(text(f"ALTER TABLE {table} RENAME COLUMN {tmp} TO {new}"))
+    return len(rows)
+
+
+def migrate_binary_columns(engine: Engine = default_engine) -> dict:
+    """
+    Pasa las columnas de tablas creadas antes del formato binario:
+    detections.bounding_boxes (JSON -> cajas empaquetadas) y
+    session_events.snapshot_b64 (texto base64 -> BLOB "snapshot").
+    Si ya están migradas no hace nada.
+    """
+    converted = {"bounding_boxes": 0, "snapshots": 0}
+
+    with engine.begin() as conn:
+        insp = inspect(conn)
+        if insp.has_table("detections"):
+            columns = {c["name"]: c for c in insp.get_columns("detections")}
+            boxes = columns.get("bounding_boxes")
+            if boxes is not None and not isinstance(boxes["type"], LargeBinary):
+                converted["bounding_boxes"] = _convert_column(
+                    conn, "detections", "bounding_boxes", "bounding_boxes", _pack_legacy_boxes
+                )
+
+        if insp.has_table("session_events"):
+            columns = {c["name"] for c in insp.get_columns("session_events")}
+            if "snapshot_b64" in columns and "snapshot" not in columns:
+                converted["snapshots"] = _convert_column(
+                    conn, "session_events", "snapshot_b64", "snapshot", _decode_legacy_snapshot
+                )
+
+    return converted
+
+
+if __name__ == "__main__":
+    converted = migrate_binary_columns()
+    print(f"[INFO] Columnas binarias: {converted['bounding_boxes']} detecciones, "
+          f"{converted['snapshots']} snapshots convertidos")
+    rows = rebuild_hourly_stats()
+    print(f"[INFO] hourly_stats reconstruida: {rows} horas")
@@ -22,7 +22,7 @@ class DetectionCreate(BaseModel):
     person_count: int
     camera_id: str = "default"
     confidence_avg: float
-    bounding_boxes: Optional[List[dict]] = None
+    bounding_boxes: Optional[List[BoundingBox]] = None
 
 
 class DetectionResponse(BaseModel):
@@ -18,6 +18,21 @@ const saveHeatmaps = (heatmaps) => { try { localStorage.setItem(HEATMAP_STORAGE_
 const formatTime = (d) => new Date(d).toLocaleTimeString('es-AR', { hour: '2-digit', minute: '2-digit', second: '2-digit' })
 const formatTimeShort = (d) => new Date(d).toLocaleTimeString('es-AR', { hour: '2-digit', minute: '2-digit' })
 const formatDateTime = (d) => new Date(d).toLocaleString('es-AR', { day: '2-digit', month: '2-digit', hour: '2-digit', minute: '2-digit' })
+// Mensajes binarios al servidor: primer byte = tipo, resto = payload
+const MSG_FRAME = 0
+const frameMessage = (blob) => new Blob([Uint8Array.of(MSG_FRAME), blob])
+// Captura el video a JPEG como Blob (null si no hay video)
+const captureJpeg = (v, c) => new Promise(resolve => {
+  c.width = v.videoWidth; c.height = v.videoHeight
+  c.getContext('2d').drawImage(v, 0, 0)
+  c.toBlob(resolve, 'image/jpeg', 0.7)
+})
+
+// Frames binarios del WebSocket → object URL (libera la URL del frame anterior)
+const swapBlobUrl = (prev, blob) => {
+  if (prev?.startsWith('blob:')) URL.revokeObjectURL(prev)
+  return blob ? URL.createObjectURL(blob) : null
+}
 const formatDuration = (ms) => {
   const s = Math.floor(ms / 1000)
   if (s < 60) return `${s}s`
@@ -28,11 +43,13 @@ const formatDuration = (ms) => {
 }
 
 // ============ HOOKS ============
-function useWebSocket(url, onMessage) {
+function useWebSocket(url, onMessage, onBinary) {
   const wsRef = useRef(null)
   const [isConnected, setIsConnected] = useState(false)
   const onMessageRef = useRef(onMessage)
+  const onBinaryRef = useRef(onBinary)
   useEffect(() => { onMessageRef.current = onMessage }, [onMessage])
+  useEffect(() => { onBinaryRef.current = onBinary }, [onBinary])
 
   useEffect(() => {
     let reconnectTimeout = null, isUnmounted = false
@@ -43,7 +60,15 @@ function useWebSocket(url, onMessage) {
       ws.onopen = () => !isUnmounted && setIsConnected(true)
       ws.onclose = () => { if (!isUnmounted) { setIsConnected(false); reconnectTimeout = setTimeout(connect, 3000) } }
       ws.onerror = () => {}
-      ws.onmessage = (e) => { try { onMessageRef.current(JSON.parse(e.data)) } catch {} }
+      ws.onmessage = (e) => {
+        if (typeof e.data !== 'string') { onBinaryRef.current?.(e.data); return }
+        try {
+          const data = JSON.parse(e.data)
+          // El servidor agrupa los mensajes acumulados en un solo batch
+          if (data.type === 'batch') data.items.forEach(item => onMessageRef.current(item))
+          else onMessageRef.current(data)
+        } catch {}
+      }
     }
     connect()
     return () => { isUnmounted = true; clearTimeout(reconnectTimeout); wsRef.current?.close() }
@@ -52,7 +77,10 @@ function useWebSocket(url, onMessage) {
   const send = useCallback((data) => {
     if (wsRef.current?.readyState === WebSocket.OPEN) wsRef.current.send(JSON.stringify(data))
   }, [])
-  return { isConnected, send }
+  const sendFrame = useCallback((blob) => {
+    if (wsRef.current?.readyState === WebSocket.OPEN) wsRef.current.send(frameMessage(blob))
+  }, [])
+  return { isConnected, send, sendFrame }
 }
 
 function useCamera() {
@@ -87,12 +115,9 @@ function useCamera() {
     setIsStreaming(false)
   }, [])
 
-  const captureFrame = useCallback(() => {
+  const captureFrame = useCallback(async () => {
     if (!videoRef.current || !canvasRef.current || !isStreaming) return null
-    const v = videoRef.current, c = canvasRef.current
-    c.width = v.videoWidth; c.height = v.videoHeight
-    c.getContext('2d').drawImage(v, 0, 0)
-    return c.toDataURL('image/jpeg', 0.7).split(',')[1]
+    return captureJpeg(videoRef.current, canvasRef.current)
   }, [isStreaming])
 
   return { videoRef, canvasRef, devices, selectedDevice, setSelectedDevice, isStreaming, startCamera, stopCamera, captureFrame }
@@ -464,7 +489,7 @@ export default function App() {
     sessionRef.current.events.unshift(event)
   }
 
-  const { isConnected, send } = useWebSocket(`${WS_URL}/detect`, (data) => {
+  const { isConnected, sendFrame } = useWebSocket(`${WS_URL}/detect`, (data) => {
     if (data.type !== 'detection') return
 
     const count = data.count || 0
@@ -474,7 +499,6 @@ export default function App() {
     const now = Date.now()
 
     setCurrentCount(count)
-    setProcessedFrame(`data:image/jpeg;base64,${data.frame}`)
 
     // Chart data
     const newPoint = { count, timestamp, time: formatTimeShort(timestamp) }
@@ -549,7 +573,7 @@ export default function App() {
     }
 
     prevCountRef.current = count
-  })
+  }, (blob) => setProcessedFrame(prev => swapBlobUrl(prev, blob)))
 
   const handleStart = async () => {
     sessionRef.current = {
@@ -582,11 +606,10 @@ export default function App() {
   useEffect(() => {
     if (!isStreaming || !isConnected) return
     const interval = setInterval(() => {
-      const frame = captureFrame()
-      if (frame) send({ type: 'frame', frame })
+      captureFrame().then(blob => { if (blob) sendFrame(blob) })
     }, 400)
     return () => clearInterval(interval)
-  }, [isStreaming, isConnected, captureFrame, send])
+  }, [isStreaming, isConnected, captureFrame, sendFrame])
 
   // ============ HEATMAP FUNCTIONS ============
   const handleReferenceUpload = (e) => {
@@ -621,12 +644,9 @@ export default function App() {
     setHeatmapStreaming(false)
   }
 
-  const captureHeatmapFrame = () => {
+  const captureHeatmapFrame = async () => {
     if (!heatmapVideoRef.current || !heatmapCanvasRef.current || !heatmapStreaming) return null
-    const v = heatmapVideoRef.current, c = heatmapCanvasRef.current
-    c.width = v.videoWidth; c.height = v.videoHeight
-    c.getContext('2d').drawImage(v, 0, 0)
-    return c.toDataURL('image/jpeg', 0.7).split(',')[1]
+    return captureJpeg(heatmapVideoRef.current, heatmapCanvasRef.current)
   }
 
   const startHeatmap = async () => {
@@ -652,27 +672,36 @@ export default function App() {
       ws.send(JSON.stringify(initMsg))
     }
     
+    const handleHeatmapMessage = (data) => {
+      if (data.type === 'heatmap_initialized') {
+        setHeatmapActive(true)
+      } else if (data.type === 'heatmap_update') {
+        if (data.heatmap) setHeatmapImage(`data:image/jpeg;base64,${data.heatmap}`)
+        if (data.stats) setHeatmapStats(data.stats)
+        const count = data.count || 0
+        setHeatmapCount(count)
+        
+        // Trackear para estadísticas
+        heatmapCountHistoryRef.current.push(count)
+        if (count > heatmapMaxCountRef.current) {
+          heatmapMaxCountRef.current = count
+        }
+      } else if (data.type === 'heatmap_stopped' || data.type === 'final_heatmap') {
+        if (data.heatmap) setHeatmapImage(`data:image/jpeg;base64,${data.heatmap}`)
+        if (data.stats) setHeatmapStats(data.stats)
+      }
+    }
+    
     ws.onmessage = (e) => {
+      // Frame anotado en binario (JPEG)
+      if (typeof e.data !== 'string') {
+        setHeatmapFrame(prev => swapBlobUrl(prev, e.data))
+        return
+      }
       try {
-        const data = JSON.parse(e.data)
-        if (data.type === 'heatmap_initialized') {
-          setHeatmapActive(true)
-        } else if (data.type === 'heatmap_update') {
-          setHeatmapFrame(`data:image/jpeg;base64,${data.frame}`)
-          if (data.heatmap) setHeatmapImage(`data:image/jpeg;base64,${data.heatmap}`)
-          if (data.stats) setHeatmapStats(data.stats)
-          const count = data.count || 0
-          setHeatmapCount(count)
-          
-          // Trackear para estadísticas
-          heatmapCountHistoryRef.current.push(count)
-          if (count > heatmapMaxCountRef.current) {
-            heatmapMaxCountRef.current = count
-          }
-        } else if (data.type === 'heatmap_stopped' || data.type === 'final_heatmap') {
-          if (data.heatmap) setHeatmapImage(`data:image/jpeg;base64,${data.heatmap}`)
-          if (data.stats) setHeatmapStats(data.stats)
-        }
+        const parsed = JSON.parse(e.data)
+        const items = parsed.type === 'batch' ? parsed.items : [parsed]
+        items.forEach(handleHeatmapMessage)
       } catch {}
     }
     
@@ -691,7 +720,7 @@ export default function App() {
     setHeatmapActive(false)
     
     // Limpiar frame de cámara
-    setHeatmapFrame(null)
+    setHeatmapFrame(prev => swapBlobUrl(prev, null))
     
     // Calcular estadísticas finales
     const duration = Date.now() - (heatmapStartTimeRef.current || Date.now())
@@ -748,10 +777,11 @@ export default function App() {
   useEffect(() => {
     if (!heatmapActive || !heatmapStreaming) return
     const interval = setInterval(() => {
-      const frame = captureHeatmapFrame()
-      if (frame && heatmapWsRef.current?.readyState === WebSocket.OPEN) {
-        heatmapWsRef.current.send(JSON.stringify({ type: 'frame', frame }))
-      }
+      captureHeatmapFrame().then(blob => {
+        if (blob && heatmapWsRef.current?.readyState === WebSocket.OPEN) {
+          heatmapWsRef.current.send(frameMessage(blob))
+        }
+      })
     }, 500)
     return () => clearInterval(interval)
   }, [heatmapActive, heatmapStreaming])